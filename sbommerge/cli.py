@@ -6,13 +6,6 @@ from argparse import ArgumentParser, Namespace
 from pathlib import Path
 from sys import exit, stderr
 
-from lib4sbom.data.file import SBOMFile
-from lib4sbom.data.package import SBOMPackage
-from lib4sbom.data.relationship import SBOMRelationship
-from lib4sbom.generator import SBOMGenerator
-from lib4sbom.parser import SBOMParser
-from lib4sbom.sbom import SBOM
-
 from sbommerge.version import VERSION
 
 APP_NAME = "sbommerge"
@@ -63,9 +56,15 @@ def create_argument_parser() -> ArgumentParser:
         default="",
         help="output filename (default: output to stdout)",
     )
+    output_group.add_argument(
+        "--always-emit",
+        action="store_true",
+        help="generate sbom to stdout even if no differences are detected",
+    )
     return parser
 
-def validate_arguments(args) -> bool:
+
+def validate_arguments(args: Namespace) -> bool:
     if args.FILE1 == args.FILE2:
         logger.error("Must specify different filenames.")
         return False
@@ -80,16 +79,92 @@ def validate_arguments(args) -> bool:
 
     return True
 
-def set_log_level(args:Namespace):
+
+def set_log_level(args: Namespace):
     logger.setLevel(args.debug)
 
+
+def _create_relationship(
+    source, relationship_type, target, source_type="package", target_type="package"
+) -> dict:
+    # Equivalent to the relationship created by lib4sbom SBOMRelationship
+    return {
+        "source": source,
+        "type": relationship_type.strip(),
+        "target": target,
+        "source_id": None,
+        "target_id": None,
+        "source_type": source_type,
+        "target_type": target_type,
+    }
+
+
+def _process_relationships(rels, files, packages, out: list):
+    # Add relationships between known files and packages to out
+    # Could be file or package
+    name_kind = {}
+    for f in files:
+        name_kind[f["name"]] = "file"
+    for p in packages:
+        name_kind.setdefault(p["name"], "package")
+    for r in rels:
+        source_type = name_kind.get(r["source"])
+        target_type = name_kind.get(r["target"])
+        if source_type is not None and target_type is not None:
+            out.append(
+                _create_relationship(
+                    r["source"], r["type"], r["target"], source_type, target_type
+                )
+            )
+
+
+def _merge_values(item1: dict, item2: dict) -> tuple:
+    # Merge the parameters of two matching items. Returns the merged item
+    # and the number of identical and updated parameters, and of parameters
+    # only in the first (additional) or second (new) item
+    merged = {}
+    identical = updated = additional = new = 0
+    for param in item1.keys() & item2.keys():
+        p1 = item1[param]
+        p2 = item2[param]
+        if p1 == p2:
+            merged[param] = p1
+            identical += 1
+        else:
+            # Difference detected.
+            # If value is NOASSERTION, take other value
+            value = p1
+            if p1 == "NOASSERTION":
+                value = p2
+            logger.debug("%s %s %s CHANGED TO %s", param, p1, p2, value)
+            merged[param] = value
+            updated += 1
+    for param in item1.keys() - item2.keys():
+        merged[param] = item1[param]
+        additional += 1
+    for param in item2.keys() - item1.keys():
+        logger.debug("%s ---- %s NEW", param, item2[param])
+        merged[param] = item2[param]
+        new += 1
+    return merged, identical, updated, additional, new
+
+
 def main():
+    # lib4sbom is only needed to process SBOMs so avoid loading it
+    # when just handling the command line
+    from lib4sbom.data.package import SBOMPackage
+    from lib4sbom.generator import SBOMGenerator
+    from lib4sbom.parser import SBOMParser
+    from lib4sbom.sbom import SBOM
+
     parser = create_argument_parser()
     args = parser.parse_args()
     if not validate_arguments(args):
         exit(-1)
     set_log_level(args)
 
+    # parse_file() reads each SBOM with a single read() so the format can
+    # be determined from the filename; no additional buffering is required
     parser = SBOMParser(args.sbom)
     parser.parse_file(args.FILE1)
     files1 = parser.get_files()
@@ -105,14 +180,16 @@ def main():
     relationship2 = parser.get_relationships()
     file2_type = parser.get_type()
 
-    logger.debug(f"File {args.FILE1} - {file1_type}")
-    logger.debug(f"Files: {files1}")
-    logger.debug(f"Packages: {packages1}")
-    logger.debug(f"Relationships {relationship1}")
-    logger.debug(f"File {args.FILE2} - {file2_type}")
-    logger.debug(f"Files: {files2}")
-    logger.debug(f"Packages: {packages2}")
-    logger.debug(f"Relationships {relationship2}")
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logger.debug(f"File {args.FILE1} - {file1_type}")
+        logger.debug(f"Files: {files1}")
+        logger.debug(f"Packages: {packages1}")
+        logger.debug(f"Relationships {relationship1}")
+        logger.debug(f"File {args.FILE2} - {file2_type}")
+        logger.debug(f"Files: {files2}")
+        logger.debug(f"Packages: {packages2}")
+        logger.debug(f"Relationships {relationship2}")
 
     bom_format = args.sbom_type
     # bom_format = "cyclonedx" if file1_type == file2_type == "cyclonedx" else "spdx"
@@ -126,65 +203,49 @@ def main():
     identical_info = 0
     additional_info = 0
     merged_info = 0
+    new_info = 0
 
     # Process files
-    sbom_file = SBOMFile()
     files = {}
+    # Index files by name to avoid repeated linear searches
+    files2_by_name = {f["name"]: f for f in files2}
+    # Names of files in second SBOM which have been merged
+    merged_files2 = set()
     for file in files1:
-        sbom_file.initialise()
-        if file in files2:
-            for file2 in files2:
-                if file2["name"] == file["name"]:
-                    # Process each parameter
-                    for param in file:
-                        p1 = file[param]
-                        if param in file2:
-                            p2 = file2[param]
-                            if p1 == p2:
-                                sbom_file.set_value(param, p1)
-                                identical_info += 1
-                            else:
-                                # Difference detected.
-                                # If value is NOASSERTION, take other value
-                                value = p1
-                                if p1 == "NOASSERTION":
-                                    value = p2
-                                logger.debug(param, p1, p2, "CHANGED TO", value)
-                                sbom_file.set_value(param, value)
-                                updated_info += 1
-                        else:
-                            sbom_file.set_value(param, p1)
-                            additional_info += 1
-                    for param in file2:
-                        if param not in file:
-                            logger.debug(param, "----", file2[param], "NEW")
-                            sbom_file.set_value(param, file2[param])
+        file2 = files2_by_name.get(file["name"])
+        if file2 is not None:
+            merged_files2.add(file2["name"])
+            merged, identical, updated, additional, new = _merge_values(
+                file, file2
+            )
+            identical_info += identical
+            updated_info += updated
+            additional_info += additional
+            new_info += new
         else:
-            logger.debug(file["name"], "UNIQUE 1")
-            sbom_file.copy_file(file)
+            logger.debug("%s: UNIQUE 1", file["name"])
+            merged = dict(file)
             merged_info += 1
-        files[sbom_file.get_name()] = sbom_file.get_file()
+        files[merged["name"]] = merged
     for file in files2:
-        sbom_file.initialise()
         if len(files1) > 0:
-            if file not in files1:
-                logger.debug(file["name"], "UNIQUE 2")
-                sbom_file.copy_file(file)
+            if file["name"] not in merged_files2:
+                logger.debug("%s: UNIQUE 2", file["name"])
+                files[file["name"]] = dict(file)
                 merged_info += 1
-                files[sbom_file.get_name()] = sbom_file.get_file()
         else:
-            sbom_file.copy_file(file)
+            files[file["name"]] = dict(file)
             identical_info += 1
-            files[sbom_file.get_name()] = sbom_file.get_file()
 
     sbom_package = SBOMPackage()
-    sbom_relationship = SBOMRelationship()
     packages = {}
     relationships = []
 
     # Create root package
     sbom_package.initialise()
-    root_package = f"MERGETOOL-{Path(args.FILE1).name.replace('.', '-')}-{Path(args.FILE2).name.replace('.', '-')}"
+    file1_tag = Path(args.FILE1).name.replace(".", "-")
+    file2_tag = Path(args.FILE2).name.replace(".", "-")
+    root_package = f"MERGETOOL-{file1_tag}-{file2_tag}"
     parent = f"SBOM-{root_package}"
     sbom_package.set_name(root_package)
     sbom_package.set_type("application")
@@ -198,144 +259,116 @@ def main():
     packages[(sbom_package.get_name(), sbom_package.get_value("version"))] = (
         sbom_package.get_package()
     )
-    sbom_relationship.initialise()
-    sbom_relationship.set_relationship(parent, "DESCRIBES", root_package)
-    relationships.append(sbom_relationship.get_relationship())
+    relationships.append(_create_relationship(parent, "DESCRIBES", root_package))
+    # Index packages to avoid repeated linear searches. A package may be
+    # present at several versions so match on both name and version
+    packages1_keys = {(p["name"], p.get("version")) for p in packages1}
+    packages2_by_key = {(p["name"], p.get("version")): p for p in packages2}
+    packages2_by_name = {}
+    for p in packages2:
+        packages2_by_name.setdefault(p["name"], []).append(p)
+    # Packages in second SBOM which have been merged
+    merged_packages2 = set()
     for package in packages1:
-        sbom_package.initialise()
-        if package in packages2:
-            # If package version differ, don't merge
-            for package2 in packages2:
-                if package2["name"] == package["name"]:
-                    if (
-                        "version" in package.keys()
-                        and "version" in package2.keys()
-                        and package["version"] != package2["version"]
-                    ):
-                        logger.info(
-                            f"[ERROR] Version mismatch for"
-                            f" {package['name']}"
-                            f" - {package['version']}"
-                            f" {package2['version']}"
-                        )
-                        continue
-                    else:
-                        # Process each parameter within package
-                        for param in package:
-                            p1 = package[param]
-                            if param in package2:
-                                p2 = package2[param]
-                                if p1 == p2:
-                                    sbom_package.set_value(param, p1)
-                                    identical_info += 1
-                                else:
-                                    # Difference detected.
-                                    # If value is NOASSERTION, take other value
-                                    value = p1
-                                    if p1 == "NOASSERTION":
-                                        value = p2
-                                    logger.debug(param, p1, p2, "CHANGED TO", value)
-                                    sbom_package.set_value(param, value)
-                                    updated_info += 1
-                            else:
-                                sbom_package.set_value(param, p1)
-                                additional_info += 1
-                        for param in package2:
-                            if param not in package:
-                                logger.debug(f"{param} ---- {package2[param]} NEW")
-                                sbom_package.set_value(param, package2[param])
+        v1 = package.get("version")
+        key = (package["name"], v1)
+        package2 = None
+        if key not in merged_packages2:
+            package2 = packages2_by_key.get(key)
+        if package2 is None:
+            # Version may only be specified in one of the SBOMs. Don't use
+            # a package with an exact match or one which is already merged
+            for candidate in packages2_by_name.get(package["name"], []):
+                candidate_key = (candidate["name"], candidate.get("version"))
+                if (
+                    (v1 is None or candidate_key[1] is None)
+                    and candidate_key not in packages1_keys
+                    and candidate_key not in merged_packages2
+                ):
+                    package2 = candidate
+                    break
+        # If package version differ, don't merge
+        if package2 is None and package["name"] in packages2_by_name:
+            versions = " ".join(
+                str(p.get("version")) for p in packages2_by_name[package["name"]]
+            )
+            logger.info(
+                f"[ERROR] Version mismatch for {package['name']} - {v1} {versions}"
+            )
+        if package2 is not None:
+            merged_packages2.add((package2["name"], package2.get("version")))
+            merged, identical, updated, additional, new = _merge_values(
+                package, package2
+            )
+            identical_info += identical
+            updated_info += updated
+            additional_info += additional
+            new_info += new
         else:
-            logger.debug(f"{package['name']}: UNIQUE 12")
-            sbom_package.copy_package(package)
+            logger.debug("%s: UNIQUE 12", package["name"])
+            merged = dict(package)
             merged_info += 1
-        packages[(sbom_package.get_name(), sbom_package.get_value("version"))] = (
-            sbom_package.get_package()
-        )
+        packages[(merged["name"], merged.get("version"))] = merged
     for package in packages2:
-        sbom_package.initialise()
-        if package not in packages1:
-            logger.debug(f"{package['name']}: UNIQUE 2")
-            sbom_package.copy_package(package)
+        key = (package["name"], package.get("version"))
+        if key not in merged_packages2:
+            logger.debug("%s: UNIQUE 2", package["name"])
+            packages[key] = dict(package)
             merged_info += 1
-            packages[(sbom_package.get_name(), sbom_package.get_value("version"))] = (
-                sbom_package.get_package()
-            )
     # Now process relationships
-    for r in relationship1:
-        source = None
-        target = None
-        source_type = "package"
-        target_type = "package"
-        # Could be file or package
-        for f in files1:
-            if f["name"] == r["source"]:
-                source = f["name"]
-                source_type = "file"
-            elif f["name"] == r["target"]:
-                target = f["name"]
-                target_type = "file"
-        for p in packages1:
-            if p["name"] == r["source"]:
-                source = p["name"]
-            elif p["name"] == r["target"]:
-                target = p["name"]
-        if source is not None and target is not None:
-            sbom_relationship.initialise()
-            sbom_relationship.set_relationship(source, r["type"], target)
-            sbom_relationship.set_source_type(source_type)
-            sbom_relationship.set_target_type(target_type)
-            relationships.append(sbom_relationship.get_relationship())
-
-    for r in relationship2:
-        source = None
-        target = None
-        source_type = "package"
-        target_type = "package"
-        # Could be file or package
-        for f in files2:
-            if f["name"] == r["source"]:
-                source = f["name"]
-                source_type = "file"
-            elif f["name"] == r["target"]:
-                target = f["name"]
-                target_type = "file"
-        for p in packages2:
-            if p["name"] == r["source"]:
-                source = p["name"]
-            elif p["name"] == r["target"]:
-                target = p["name"]
-        if source is not None and target is not None:
-            sbom_relationship.initialise()
-            sbom_relationship.set_relationship(source, r["type"], target)
-            sbom_relationship.set_source_type(source_type)
-            sbom_relationship.set_target_type(target_type)
-            relationships.append(sbom_relationship.get_relationship())
+    relationships1 = []
+    _process_relationships(relationship1, files1, packages1, relationships1)
+    relationships2 = []
+    _process_relationships(relationship2, files2, packages2, relationships2)
+    relationships.extend(relationships1)
+    relationships.extend(relationships2)
 
     # Finally add relationships to overall document
-    for p in packages:
-        sbom_relationship.initialise()
-        sbom_relationship.set_relationship(root_package, "CONTAINS", p[0])
-        relationships.append(sbom_relationship.get_relationship())
-
-    logger.debug(f"SBOM type: {bom_format}")
-    logger.debug(f"SBOM format: {sbom_format}")
-    logger.debug(f"Output file: {args.output_file}")
-    logger.debug(f"SBOM File1: {args.FILE1}")
-    logger.debug(f"SBOM File1 - type: {file1_type}")
-    logger.debug(f"SBOM File1 - files: {len(files1)}")
-    logger.debug(f"SBOM File1 - packages: {len(packages1)}")
-    logger.debug(f"SBOM File1 - relationships: {len(relationship1)}")
-    logger.debug(f"SBOM File2: {args.FILE2}")
-    logger.debug(f"SBOM File2 - type: {file2_type}")
-    logger.debug(f"SBOM File2 - files: {len(files2)}")
-    logger.debug(f"SBOM File2 - packages: {len(packages2)}")
-    logger.debug(f"SBOM File2 - relationships: {len(relationship2)}")
-
-    print("\nSummary\n-------", file=stderr)
-    print(f"No change:  {identical_info}", file=stderr)
-    print(f"Updated:    {updated_info}", file=stderr)
-    print(f"New:        {additional_info}", file=stderr)
-    print(f"Merged:     {merged_info}\n", file=stderr)
+    relationships.extend(
+        _create_relationship(root_package, "CONTAINS", name) for name, _ in packages
+    )
+
+    if debug_enabled:
+        logger.debug(f"SBOM type: {bom_format}")
+        logger.debug(f"SBOM format: {sbom_format}")
+        logger.debug(f"Output file: {args.output_file}")
+        logger.debug(f"SBOM File1: {args.FILE1}")
+        logger.debug(f"SBOM File1 - type: {file1_type}")
+        logger.debug(f"SBOM File1 - files: {len(files1)}")
+        logger.debug(f"SBOM File1 - packages: {len(packages1)}")
+        logger.debug(f"SBOM File1 - relationships: {len(relationship1)}")
+        logger.debug(f"SBOM File2: {args.FILE2}")
+        logger.debug(f"SBOM File2 - type: {file2_type}")
+        logger.debug(f"SBOM File2 - files: {len(files2)}")
+        logger.debug(f"SBOM File2 - packages: {len(packages2)}")
+        logger.debug(f"SBOM File2 - relationships: {len(relationship2)}")
+
+    print(
+        "\nSummary\n-------\n"
+        f"No change:  {identical_info}\n"
+        f"Updated:    {updated_info}\n"
+        f"New:        {additional_info}\n"
+        f"Merged:     {merged_info}\n",
+        file=stderr,
+    )
+
+    no_differences = updated_info + additional_info + merged_info + new_info == 0
+    # Merged SBOM only matches the first SBOM if there are no differences
+    # and all files and relationships in the second SBOM were already present
+    relationships1_keys = {
+        (r["source"], r["type"], r["target"]) for r in relationships1
+    }
+    same_as_file1 = (
+        no_differences
+        and all(f["name"] in merged_files2 for f in files2)
+        and all(
+            (r["source"], r["type"], r["target"]) in relationships1_keys
+            for r in relationships2
+        )
+    )
+    # Don't generate SBOM unless explicitly requested
+    if same_as_file1 and args.output_file == "" and not args.always_emit:
+        return 0
 
     # Generate SBOM file
 
@@ -344,7 +377,8 @@ def main():
     merge_sbom.add_packages(packages)
     merge_sbom.add_relationships(relationships)
 
-    logger.debug(merge_sbom.get_sbom())
+    if debug_enabled:
+        logger.debug(merge_sbom.get_sbom())
 
     sbom_gen = SBOMGenerator(
         sbom_type=bom_format, format=sbom_format, application=APP_NAME, version=VERSION
@@ -356,7 +390,7 @@ def main():
     )
 
     # Return code indicates if any differences have been detected
-    if (updated_info or additional_info or merged_info) != 0:
+    if not same_as_file1:
         return 1
 
     return 0
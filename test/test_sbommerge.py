@@ -40,3 +40,164 @@ def test_loglevel(options, loglevel):
     args = parser.parse_args(options + [SPDX_FILE_1, SPDX_FILE_2])
     cli.set_log_level(args)
     assert(loglevel == logger.level)
+
+
+@pytest.mark.parametrize(
+    "options, always_emit",
+    [
+        ([], False),
+        (["--always-emit"], True),
+    ],
+)
+def test_always_emit(options, always_emit):
+    parser = cli.create_argument_parser()
+    args = parser.parse_args(options + [SPDX_FILE_1, SPDX_FILE_2])
+    assert always_emit == args.always_emit
+
+
+class StubParser:
+    # Returns the SBOM contents registered for each filename
+    sboms = {}
+
+    def __init__(self, sbom_type):
+        self.sbom = None
+
+    def parse_file(self, filename):
+        self.sbom = self.sboms[filename]
+
+    def set_type(self, sbom_type):
+        pass
+
+    def get_files(self):
+        return self.sbom.get("files", [])
+
+    def get_packages(self):
+        return self.sbom.get("packages", [])
+
+    def get_relationships(self):
+        return self.sbom.get("relationships", [])
+
+    def get_type(self):
+        return "spdx"
+
+
+class StubGenerator:
+    # Records the SBOM data of each generated SBOM
+    generated = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def generate(self, project_name, sbom_data, filename=""):
+        self.generated.append(sbom_data)
+
+
+@pytest.fixture
+def run_main(monkeypatch):
+    monkeypatch.setattr("lib4sbom.parser.SBOMParser", StubParser)
+    monkeypatch.setattr("lib4sbom.generator.SBOMGenerator", StubGenerator)
+    StubGenerator.generated = []
+
+    def run(sbom1, sbom2, options=()):
+        StubParser.sboms = {SPDX_FILE_1: sbom1, SPDX_FILE_2: sbom2}
+        monkeypatch.setattr(
+            "sys.argv", ["sbommerge", *options, SPDX_FILE_1, SPDX_FILE_2]
+        )
+        return cli.main()
+
+    return run
+
+
+def test_package_versions_matched(run_main):
+    sbom1 = {
+        "packages": [
+            {"name": "foo", "version": "1.0"},
+            {"name": "foo", "version": "2.0"},
+        ]
+    }
+    sbom2 = {
+        "packages": [
+            {"name": "foo", "version": "1.0", "supplier": "S1"},
+            {"name": "foo", "version": "3.0", "supplier": "S3"},
+        ]
+    }
+    assert run_main(sbom1, sbom1) == 0
+    assert run_main(sbom1, sbom2) == 1
+    packages = StubGenerator.generated[-1]["packages"]
+    assert packages[("foo", "1.0")]["supplier"] == "S1"
+    assert ("foo", "2.0") in packages
+    assert packages[("foo", "3.0")]["supplier"] == "S3"
+
+
+def test_package_version_missing(run_main):
+    sbom1 = {"packages": [{"name": "foo"}]}
+    sbom2 = {"packages": [{"name": "foo", "version": "1.0"}]}
+    run_main(sbom1, sbom2)
+    packages = StubGenerator.generated[-1]["packages"]
+    assert list(packages)[1:] == [("foo", "1.0")]
+
+
+@pytest.mark.parametrize(
+    "packages1",
+    [
+        [{"name": "foo", "version": "1.0", "id": 1}, {"name": "foo", "id": 2}],
+        [{"name": "foo", "id": 2}, {"name": "foo", "version": "1.0", "id": 1}],
+    ],
+)
+def test_package_merged_once(run_main, packages1):
+    sbom2 = {"packages": [{"name": "foo", "version": "1.0", "id": 1}]}
+    run_main({"packages": packages1}, sbom2)
+    packages = StubGenerator.generated[-1]["packages"]
+    assert packages[("foo", "1.0")]["id"] == 1
+    assert packages[("foo", None)]["id"] == 2
+
+
+FILE_A = {"name": "a.c", "id": "SPDXRef-File-a"}
+PACKAGE_A = {"name": "a", "id": "SPDXRef-1-a", "version": "1.0"}
+PACKAGE_B = {"name": "b", "id": "SPDXRef-2-b", "version": "2.0"}
+RELATIONSHIP_AB = {"source": "a", "type": "DEPENDS_ON", "target": "b"}
+
+
+@pytest.mark.parametrize(
+    "options, generated",
+    [
+        ([], False),
+        (["--always-emit"], True),
+        (["-o", "merged.spdx"], True),
+    ],
+)
+def test_identical_sboms(run_main, options, generated):
+    sbom = {
+        "files": [FILE_A],
+        "packages": [PACKAGE_A, PACKAGE_B],
+        "relationships": [RELATIONSHIP_AB],
+    }
+    assert run_main(sbom, sbom, options) == 0
+    assert generated == (len(StubGenerator.generated) == 1)
+
+
+@pytest.mark.parametrize(
+    "sbom1, sbom2",
+    [
+        ({}, {"files": [FILE_A]}),  # Files only in second SBOM
+        (
+            {"packages": [PACKAGE_A, PACKAGE_B]},
+            {"packages": [PACKAGE_A, PACKAGE_B], "relationships": [RELATIONSHIP_AB]},
+        ),  # Relationships only in second SBOM
+        (
+            {"files": [FILE_A]},
+            {"files": [{**FILE_A, "checksum": [["SHA1", "a" * 40]]}]},
+        ),  # File parameters only in second SBOM
+        (
+            {"packages": [PACKAGE_A]},
+            {"packages": [{**PACKAGE_A, "supplier": "S1"}]},
+        ),  # Package parameters only in second SBOM
+        (
+            {"packages": [{"name": "a"}]},
+            {"packages": [{"name": "a", "version": "1.0"}]},
+        ),  # Package version only in second SBOM
+    ],
+)
+def test_second_sbom_content_generated(run_main, sbom1, sbom2):
+    assert run_main(sbom1, sbom2) == 1
+    assert len(StubGenerator.generated) == 1